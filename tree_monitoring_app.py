@@ -1,22 +1,23 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime
-from geopy.distance import geodesic
+import math
 from pathlib import Path
-import re
 import random
 import os
 import time
 import sqlite3
+import threading
 import plotly.express as px
 import plotly.graph_objects as go
 import hashlib
-from typing import Optional, Tuple, Dict, Any
-from geopy.geocoders import Nominatim
+import hmac
+from typing import Optional, Tuple, Dict, Any, Iterator, List, Sequence
+from contextlib import contextmanager
 
 # --- Custom CSS for Styling ---
-def load_css():
-    st.markdown("""
+_CSS = """
     <style>
         /* Main styling */
         body {
@@ -62,6 +63,19 @@ def load_css():
             margin-bottom: 1.5rem;
         }
         
+        /* Metric cards laid out two per row, stacking on narrow screens */
+        .card-grid {
+            display: grid;
+            grid-template-columns: repeat(2, minmax(0, 1fr));
+            column-gap: 1rem;
+        }
+        
+        @media (max-width: 640px) {
+            .card-grid {
+                grid-template-columns: 1fr;
+            }
+        }
+        
         /* Tree visualization */
         .tree-visualization {
             text-align: center;
@@ -121,7 +135,19 @@ def load_css():
             color: #666;
         }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def load_css():
+    # The style block goes out on every run either way: st.cache_* would replay this
+    # st.markdown on a hit, so there is nothing to cache beyond the prebuilt string.
+    st.markdown(_CSS, unsafe_allow_html=True)
+
+_CARD_HTML = '<div class="card"><h3>{title}</h3><h2>{value}</h2></div>'
+
+def render_cards(cards: Sequence[Tuple[str, Any]]):
+    """Render (title, value) metric cards, two per row, with a single markdown element."""
+    html = "".join(_CARD_HTML.format(title=title, value=value) for title, value in cards)
+    st.markdown(f'<div class="card-grid">{html}</div>', unsafe_allow_html=True)
 
 # --- Configuration ---
 DEFAULT_SPECIES = ["Acacia", "Eucalyptus", "Mango", "Neem", "Oak", "Pine"]
@@ -130,9 +156,33 @@ DATA_DIR = BASE_DIR / "data"
 SQLITE_DB = DATA_DIR / "trees.db"
 STORAGE_METHOD = "sqlite"
 
+# --- CO₂ Model Constants ---
+DEFAULT_WOOD_DENSITY = 0.6
+AGB_DBH_K = 0.0509       # above-ground biomass coefficient for mature trees (DBH)
+AGB_RCD_K = 0.042        # above-ground biomass coefficient for young trees (RCD)
+BGB_RATIO = 0.2          # below-ground biomass as a share of above-ground
+CARBON_FRACTION = 0.47
+CO2_PER_CARBON = 3.67
+
 # --- Password Hashing ---
+SCRYPT_PARAMS = {"n": 16384, "r": 8, "p": 1}
+# Legacy unsalted SHA-256 of the demo default, precomputed once
+ADMIN_PWD_HASH = hashlib.sha256(b"admin123").hexdigest()
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+    return f"{salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    """Check a password against a 'salt$hash' scrypt value or a legacy SHA-256 hex digest."""
+    if not stored:
+        return False
+    if "$" in stored:
+        salt_hex, digest_hex = stored.split("$", 1)
+        digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt_hex), **SCRYPT_PARAMS)
+        return hmac.compare_digest(digest.hex(), digest_hex)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
 
 # --- User Types ---
 USER_TYPES = {
@@ -142,225 +192,536 @@ USER_TYPES = {
 }
 
 # --- Database Initialization with Migration ---
-def initialize_data_files():
+def initialize_data_files(force: bool = False):
     DATA_DIR.mkdir(exist_ok=True, parents=True)
-    if STORAGE_METHOD == "sqlite":
+    # Schema setup takes a write lock, so run it once per session rather than every rerun
+    if STORAGE_METHOD == "sqlite" and (force or not st.session_state.get("db_ready")):
         init_db()
+        st.session_state.db_ready = True
+
+# Tables and indexes, created in one executescript call. Institution names are
+# matched case-insensitively throughout the app, hence the NOCASE index; keeping
+# each institution's rows ordered by date_planted lets the timeline group without a sort.
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS trees (
+    tree_id TEXT PRIMARY KEY,
+    institution TEXT COLLATE NOCASE,
+    local_name TEXT,
+    scientific_name TEXT,
+    student_name TEXT,
+    date_planted TEXT,
+    tree_stage TEXT,
+    rcd_cm REAL,
+    dbh_cm REAL,
+    height_m REAL,
+    latitude REAL,
+    longitude REAL,
+    co2_kg REAL,
+    status TEXT,
+    county TEXT,
+    sub_county TEXT,
+    ward TEXT,
+    adopter_name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_trees_institution_ci ON trees(institution COLLATE NOCASE, date_planted);
+CREATE INDEX IF NOT EXISTS idx_trees_status_adopter ON trees(status, adopter_name);
+CREATE INDEX IF NOT EXISTS idx_trees_sci ON trees(scientific_name);
+
+CREATE TABLE IF NOT EXISTS species (
+    scientific_name TEXT PRIMARY KEY COLLATE NOCASE,
+    local_name TEXT COLLATE NOCASE UNIQUE,
+    wood_density REAL,
+    benefits TEXT
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT,
+    user_type TEXT,
+    institution TEXT
+);
+"""
+
+def _has_primary_key(conn: sqlite3.Connection, table: str) -> bool:
+    """Whether the table kept its PRIMARY KEY; tables rewritten by pandas to_sql lost it."""
+    return any(row[3] == "pk" for row in conn.execute(f"PRAGMA index_list({table})"))
 
 def init_db():
-    conn = sqlite3.connect(SQLITE_DB)
+    conn = get_conn()
     c = conn.cursor()
     
-    # Check if old 'school' column exists
-    c.execute("PRAGMA table_info(users)")
-    columns = [col[1] for col in c.fetchall()]
-    
-    # Create tables with new schema if they don't exist
-    c.execute("""CREATE TABLE IF NOT EXISTS trees (
-        tree_id TEXT PRIMARY KEY,
-        institution TEXT,
-        local_name TEXT,
-        scientific_name TEXT,
-        student_name TEXT,
-        date_planted TEXT,
-        tree_stage TEXT,
-        rcd_cm REAL,
-        dbh_cm REAL,
-        height_m REAL,
-        latitude REAL,
-        longitude REAL,
-        co2_kg REAL,
-        status TEXT,
-        county TEXT,
-        sub_county TEXT,
-        ward TEXT,
-        adopter_name TEXT
-    )""")
-    
-    c.execute("""CREATE TABLE IF NOT EXISTS species (
-        scientific_name TEXT PRIMARY KEY,
-        local_name TEXT,
-        wood_density REAL,
-        benefits TEXT
-    )""")
+    # Check if old 'school' column exists, unless the new schema is already confirmed
+    schema_check = not users_has_institution()
+    columns = [col[1] for col in c.execute("PRAGMA table_info(users)")] if schema_check else []
+    migrated = False
     
-    c.execute("""CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password TEXT,
-        user_type TEXT,
-        institution TEXT
-    )""")
-    
-    # Migrate from old schema if needed
-    if 'school' in columns and 'institution' not in columns:
+    # Create tables with new schema if they don't exist. executescript commits any
+    # open transaction before it starts, so the script carries its own BEGIN/COMMIT.
+    with _write_lock():
         try:
-            # SQLite doesn't support direct column renaming, so we need to:
-            # 1. Create a new table
-            # 2. Copy data from old table
-            # 3. Drop old table
-            # 4. Rename new table
-            
-            # Create temporary table with new schema
-            c.execute("""
-                CREATE TABLE users_new (
-                    username TEXT PRIMARY KEY,
-                    password TEXT,
-                    user_type TEXT,
-                    institution TEXT
-                )
-            """)
-            
-            # Copy data from old table
-            c.execute("""
-                INSERT INTO users_new (username, password, user_type, institution)
-                SELECT username, password, user_type, school FROM users
-            """)
-            
-            # Drop old table
-            c.execute("DROP TABLE users")
-            
-            # Rename new table
-            c.execute("ALTER TABLE users_new RENAME TO users")
-            
-            conn.commit()
-            st.info("Database schema migrated from 'school' to 'institution'")
-        except Exception as e:
-            conn.rollback()
-            st.error(f"Migration failed: {str(e)}")
+            c.executescript(f"BEGIN IMMEDIATE;{_SCHEMA_SQL}COMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
     
-    # Initialize default data
-    if c.execute("SELECT COUNT(*) FROM species").fetchone()[0] == 0:
-        default_species = [
-            ("Acacia spp.", "Acacia", 0.65, "Drought-resistant, nitrogen-fixing, provides shade"),
-            ("Eucalyptus spp.", "Eucalyptus", 0.55, "Fast-growing, timber production, medicinal uses"),
-            ("Mangifera indica", "Mango", 0.50, "Fruit production, shade tree, ornamental"),
-            ("Azadirachta indica", "Neem", 0.60, "Medicinal properties, insect repellent, drought-resistant"),
-            ("Quercus spp.", "Oak", 0.75, "Long-term carbon storage, wildlife habitat, durable wood"),
-            ("Pinus spp.", "Pine", 0.45, "Reforestation, timber production, resin production")
-        ]
-        c.executemany("INSERT INTO species VALUES (?, ?, ?, ?)", default_species)
-    
-    # Update admin user with new schema
-    c.execute("""INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?)""", 
-             ("admin", hash_password("admin123"), "admin", "All Institutions"))
+    # Run the migration and seeding as a single transaction
+    with transaction(conn):
+        # Tables rewritten by pandas to_sql lost the primary key; index tree_id in its place
+        if not _has_primary_key(conn, "trees"):
+            try:
+                c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_trees_tree_id ON trees(tree_id)")
+            except sqlite3.IntegrityError:
+                # Duplicate IDs in the old data; keep lookups indexed without the constraint
+                c.execute("CREATE INDEX IF NOT EXISTS idx_trees_tree_id ON trees(tree_id)")
+        
+        if not _has_primary_key(conn, "species"):
+            try:
+                # Stand in for the lost primary key; skip if the table already holds duplicates
+                c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_species_sci_nocase ON species(scientific_name COLLATE NOCASE)")
+            except sqlite3.IntegrityError:
+                pass
+        
+        # Migrate from old schema if needed
+        if 'school' in columns and 'institution' not in columns:
+            c.execute("SAVEPOINT migrate_users")
+            try:
+                # SQLite doesn't support direct column renaming, so we need to:
+                # 1. Create a new table
+                # 2. Copy data from old table
+                # 3. Drop old table
+                # 4. Rename new table
+                
+                # Create temporary table with new schema
+                c.execute("""
+                    CREATE TABLE users_new (
+                        username TEXT PRIMARY KEY,
+                        password TEXT,
+                        user_type TEXT,
+                        institution TEXT
+                    )
+                """)
+                
+                # Copy data from old table
+                c.execute("""
+                    INSERT INTO users_new (username, password, user_type, institution)
+                    SELECT username, password, user_type, school FROM users
+                """)
+                
+                # Drop old table
+                c.execute("DROP TABLE users")
+                
+                # Rename new table
+                c.execute("ALTER TABLE users_new RENAME TO users")
+                
+                c.execute("RELEASE migrate_users")
+                migrated = True
+            except Exception as e:
+                c.execute("ROLLBACK TO migrate_users")
+                c.execute("RELEASE migrate_users")
+                st.error(f"Migration failed: {str(e)}")
+        
+        # Initialize default data
+        if c.execute("SELECT COUNT(*) FROM species").fetchone()[0] == 0:
+            default_species = [
+                ("Acacia spp.", "Acacia", 0.65, "Drought-resistant, nitrogen-fixing, provides shade"),
+                ("Eucalyptus spp.", "Eucalyptus", 0.55, "Fast-growing, timber production, medicinal uses"),
+                ("Mangifera indica", "Mango", 0.50, "Fruit production, shade tree, ornamental"),
+                ("Azadirachta indica", "Neem", 0.60, "Medicinal properties, insect repellent, drought-resistant"),
+                ("Quercus spp.", "Oak", 0.75, "Long-term carbon storage, wildlife habitat, durable wood"),
+                ("Pinus spp.", "Pine", 0.45, "Reforestation, timber production, resin production")
+            ]
+            c.executemany("INSERT INTO species VALUES (?, ?, ?, ?)", default_species)
+            c.execute("ANALYZE")
+        
+        # Update admin user with new schema
+        c.execute("""INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?)""", 
+                 ("admin", ADMIN_PWD_HASH, "admin", "All Institutions"))
     
-    conn.commit()
-    conn.close()
+    if schema_check:
+        users_has_institution.clear()
+    if migrated:
+        st.info("Database schema migrated from 'school' to 'institution'")
+
+# --- Connection & Cache Helpers ---
+sqlite3.register_adapter(np.int64, int)
+
+def _connect() -> sqlite3.Connection:
+    """Open a connection in autocommit mode with the app's performance pragmas."""
+    conn = sqlite3.connect(SQLITE_DB, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    """Shared SQLite connection, reused across reruns and sessions."""
+    return _connect()
+
+@st.cache_resource
+def _write_lock() -> threading.Lock:
+    """Serialises transactions on the shared connection across sessions' script threads."""
+    return threading.Lock()
+
+@contextmanager
+def transaction(conn: Optional[sqlite3.Connection] = None) -> Iterator[sqlite3.Connection]:
+    """Run the enclosed statements in one BEGIN IMMEDIATE ... COMMIT block."""
+    conn = conn or get_conn()
+    with _write_lock():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def close_conn():
+    """Close the shared connection, e.g. before the database file is deleted."""
+    with _write_lock():
+        get_conn().close()
+        get_conn.clear()
+    users_has_institution.clear()
+
+@st.cache_resource
+def users_has_institution() -> bool:
+    """Whether the users table has the 'institution' column; fixed once migrated."""
+    columns = [col[1] for col in get_conn().execute("PRAGMA table_info(users)")]
+    return 'institution' in columns
+
+# (in-session write counter, latest mtime of the database files)
+DataVersion = Tuple[int, int]
+
+def _db_mtime_ns() -> int:
+    # WAL writes land in the -wal file until checkpointed, so check both
+    paths = (SQLITE_DB, SQLITE_DB.with_name(SQLITE_DB.name + "-wal"))
+    return max((p.stat().st_mtime_ns for p in paths if p.exists()), default=0)
+
+def data_version() -> DataVersion:
+    """Cache key for table data; changes on our own writes and on writes by other processes."""
+    return st.session_state.get("trees_version", 0), _db_mtime_ns()
+
+def invalidate_data_cache():
+    """Bump the data version and drop cached tables after a write."""
+    st.session_state["trees_version"] = st.session_state.get("trees_version", 0) + 1
+    _load_tree_columns.clear()
+    _load_species_data.clear()
+    _load_institution_trees.clear()
+    _institution_stats.clear()
+    _planting_timeline.clear()
+    _load_admin_metrics.clear()
+    _species_density_map.clear()
+    _species_lookup.clear()
+    _admin_figures.clear()
+    _tree_coord_index.clear()
 
 # --- Tree Management Functions ---
-def load_tree_data() -> pd.DataFrame:
-    conn = sqlite3.connect(SQLITE_DB)
-    df = pd.read_sql("SELECT * FROM trees", conn)
-    conn.close()
-    return df
+# Narrower dtypes for the cached tree frames. Coordinates stay float64 for distance accuracy,
+# and co2_kg so its totals match the SQL sums shown elsewhere.
+# Free-text columns use Arrow-backed strings (pyarrow ships with Streamlit).
+TREE_DTYPES = {
+    "height_m": "float32", "rcd_cm": "float32", "dbh_cm": "float32",
+    "status": "category", "tree_stage": "category", "institution": "category",
+    **dict.fromkeys(["tree_id", "local_name", "scientific_name", "student_name", "date_planted",
+                     "county", "sub_county", "ward", "adopter_name"], "string[pyarrow]"),
+}
+
+def _with_tree_dtypes(trees: pd.DataFrame) -> pd.DataFrame:
+    return trees.astype({col: dtype for col, dtype in TREE_DTYPES.items() if col in trees.columns})
+
+@st.cache_data(ttl=60)
+def _load_tree_columns(version: DataVersion, columns: Tuple[str, ...]) -> pd.DataFrame:
+    return _with_tree_dtypes(pd.read_sql(f"SELECT {', '.join(columns)} FROM trees", get_conn()))
+
+@st.cache_data(ttl=60)
+def _load_species_data(version: DataVersion) -> pd.DataFrame:
+    return pd.read_sql("SELECT * FROM species", get_conn())
+
+def load_trees_by_id(tree_ids: Sequence[str], batch_size: int = 500) -> pd.DataFrame:
+    """Full rows for specific trees, queried in batches below SQLite's parameter limit."""
+    conn = get_conn()
+    frames = []
+    for start in range(0, len(tree_ids), batch_size):
+        batch = list(tree_ids[start:start + batch_size])
+        placeholders = ", ".join("?" for _ in batch)
+        frames.append(pd.read_sql(f"SELECT * FROM trees WHERE tree_id IN ({placeholders})", conn, params=batch))
+    if not frames:
+        return pd.read_sql("SELECT * FROM trees LIMIT 0", conn)
+    return pd.concat(frames, ignore_index=True)
 
 def load_species_data() -> pd.DataFrame:
-    conn = sqlite3.connect(SQLITE_DB)
-    df = pd.read_sql("SELECT * FROM species", conn)
-    conn.close()
-    return df
+    return _load_species_data(data_version())
+
+@st.cache_data(ttl=60)
+def _load_institution_trees(version: DataVersion, institution_name: str) -> pd.DataFrame:
+    return _with_tree_dtypes(pd.read_sql("SELECT * FROM trees WHERE institution = ? COLLATE NOCASE",
+                                         get_conn(), params=(institution_name,)))
+
+def load_institution_trees(institution_name: str) -> pd.DataFrame:
+    """One institution's trees, matched case-insensitively via the NOCASE index."""
+    return _load_institution_trees(data_version(), institution_name)
+
+@st.cache_data(ttl=60)
+def _institution_stats(version: DataVersion, institution_name: str) -> Dict[str, Any]:
+    trees = _load_institution_trees(version, institution_name)
+    # One grouped pass for the card figures; dropna keeps trees with no status in the totals.
+    by_status = trees.groupby("status", sort=False, observed=True, dropna=False).agg(
+        n=("tree_id", "size"),
+        co2=("co2_kg", "sum"),
+        adopted=("adopter_name", "count"),
+    )
+    heights = trees["height_m"].to_numpy(dtype=np.float32, na_value=np.nan)
+    return {
+        "total": int(by_status["n"].sum()),
+        "alive": int(by_status["n"].get("Alive", 0)),
+        "co2": float(by_status["co2"].sum()),
+        "adopted": int(by_status["adopted"].sum()),
+        "species_counts": trees["scientific_name"].value_counts().head(5).reset_index(),
+        # 20 height bins, so the chart only ships bin counts rather than every tree's height
+        "height_hist": np.histogram(heights[~np.isnan(heights)], bins=20),
+    }
+
+def institution_stats(institution_name: str) -> Dict[str, Any]:
+    """Card totals and top-5 species for the institution analytics tab."""
+    return _institution_stats(data_version(), institution_name)
+
+@st.cache_data(ttl=60)
+def _planting_timeline(version: DataVersion, institution_name: str) -> pd.DataFrame:
+    # Group by day in SQL so only the distinct planting dates are parsed
+    daily = pd.read_sql(
+        """SELECT date_planted, COUNT(*) AS planted FROM trees
+           WHERE institution = ? COLLATE NOCASE AND date_planted IS NOT NULL
+           GROUP BY date_planted ORDER BY date_planted""",
+        get_conn(), params=(institution_name,), parse_dates=["date_planted"]
+    )
+    return pd.DataFrame({"Date": daily["date_planted"], "Total Trees": daily["planted"].cumsum()})
 
-def save_tree_data(df: pd.DataFrame) -> bool:
+def planting_timeline(institution_name: str) -> pd.DataFrame:
+    """Cumulative number of trees planted by an institution, per planting date."""
+    return _planting_timeline(data_version(), institution_name)
+
+@st.cache_data(ttl=30)
+def _load_admin_metrics(version: DataVersion) -> Dict[str, Any]:
+    conn = get_conn()
+    row = conn.execute("""SELECT COUNT(DISTINCT institution COLLATE NOCASE), COUNT(*), COUNT(adopter_name),
+                                 COALESCE(SUM(co2_kg), 0) FROM trees""").fetchone()
+    metrics = dict(zip(["institutions", "total", "adopted", "co2"], row))
+    # Explicit NOCASE: older databases were created without the column collation
+    metrics["co2_by_institution"] = pd.read_sql(
+        """SELECT institution, SUM(co2_kg) AS co2_kg FROM trees WHERE institution IS NOT NULL
+           GROUP BY institution COLLATE NOCASE""", conn)
+    metrics["status_counts"] = pd.read_sql(
+        "SELECT status, COUNT(*) AS count FROM trees WHERE status IS NOT NULL GROUP BY status ORDER BY count DESC", conn)
+    metrics["species_counts"] = pd.read_sql(
+        """SELECT scientific_name, COUNT(*) AS count FROM trees WHERE scientific_name IS NOT NULL
+           GROUP BY scientific_name ORDER BY count DESC LIMIT 10""", conn)
+    return metrics
+
+def load_admin_metrics() -> Dict[str, Any]:
+    """Aggregates for the admin analytics tab, computed in SQL."""
+    return _load_admin_metrics(data_version())
+
+@st.cache_data(ttl=60)
+def _species_density_map(version: DataVersion) -> Dict[str, float]:
+    return dict(get_conn().execute("SELECT scientific_name, wood_density FROM species").fetchall())
+
+def species_density_map() -> Dict[str, float]:
+    return _species_density_map(data_version())
+
+@st.cache_data(ttl=60)
+def _species_lookup(version: DataVersion) -> Dict[str, str]:
+    return dict(get_conn().execute(
+        "SELECT local_name, scientific_name FROM species WHERE local_name IS NOT NULL ORDER BY rowid").fetchall())
+
+def species_lookup() -> Dict[str, str]:
+    """Scientific name for each species' local name."""
+    return _species_lookup(data_version())
+
+def insert_tree(tree: Dict[str, Any]) -> bool:
+    """Insert a single new tree row."""
     try:
-        conn = sqlite3.connect(SQLITE_DB)
-        df.to_sql("trees", conn, if_exists="replace", index=False)
-        conn.close()
+        columns = ", ".join(tree)
+        placeholders = ", ".join("?" for _ in tree)
+        with transaction() as conn:
+            conn.execute(f"INSERT INTO trees ({columns}) VALUES ({placeholders})", tuple(tree.values()))
+        invalidate_data_cache()
         return True
     except Exception as e:
         st.error(f"Database error: {e}")
         return False
 
-def save_species_data(df: pd.DataFrame) -> bool:
+def _update_fields(table: str, key: str, key_value: str, fields: Dict[str, Any]) -> bool:
     try:
-        conn = sqlite3.connect(SQLITE_DB)
-        df.to_sql("species", conn, if_exists="replace", index=False)
-        conn.close()
+        sql = f"UPDATE {table} SET " + ", ".join(f"{col} = ?" for col in fields) + f" WHERE {key} = ?"
+        with transaction() as conn:
+            conn.execute(sql, (*fields.values(), key_value))
+        invalidate_data_cache()
         return True
     except Exception as e:
         st.error(f"Database error: {e}")
         return False
 
+def update_tree_fields(tree_id: str, **fields) -> bool:
+    """Update only the given columns of a single tree."""
+    return _update_fields("trees", "tree_id", tree_id, fields)
+
+def claim_tree_for_adoption(tree_id: str, donor_name: str) -> Optional[bool]:
+    """Mark a tree adopted only if it is still alive and unadopted.
+
+    Returns True on success, False if someone else adopted it first, or None
+    if the write failed.
+    """
+    try:
+        with transaction() as conn:
+            cur = conn.execute(
+                """UPDATE trees SET status = 'Adopted', adopter_name = ?
+                   WHERE tree_id = ? AND status = 'Alive' AND adopter_name IS NULL""",
+                (donor_name, tree_id)
+            )
+        invalidate_data_cache()
+        return cur.rowcount == 1
+    except Exception as e:
+        st.error(f"Database error: {e}")
+        return None
+
+def upsert_species(scientific_name: str, local_name: str, wood_density: float, benefits: str) -> Optional[str]:
+    """Update the species matching either name (case-insensitive), or add it.
+
+    Returns "updated" or "added", or None if the write failed.
+    """
+    try:
+        with transaction() as conn:
+            cur = conn.execute(
+                """UPDATE species SET local_name = ?, wood_density = ?, benefits = ?
+                   WHERE scientific_name = ? COLLATE NOCASE OR local_name = ? COLLATE NOCASE""",
+                (local_name, wood_density, benefits, scientific_name, local_name)
+            )
+            if cur.rowcount:
+                result = "updated"
+            else:
+                conn.execute("INSERT INTO species VALUES (?, ?, ?, ?)",
+                             (scientific_name, local_name, wood_density, benefits))
+                result = "added"
+        invalidate_data_cache()
+        return result
+    except Exception as e:
+        st.error(f"Database error: {e}")
+        return None
+
 def generate_tree_id(institution_name: str) -> str:
     prefix = institution_name[:3].upper()
-    trees = load_tree_data()
-    
-    if trees.empty:
-        return f"{prefix}001"
-    
-    institution_trees = trees[trees["institution"].str.lower() == institution_name.lower()]
-    existing_ids = [id for id in institution_trees["tree_id"] if str(id).startswith(prefix)]
-    
-    if not existing_ids:
-        return f"{prefix}001"
-    
-    max_num = max([int(re.search(r'\d+$', str(id)).group()) for id in existing_ids])
+    row = get_conn().execute(
+        """SELECT MAX(CAST(SUBSTR(tree_id, LENGTH(?) + 1) AS INTEGER)) FROM trees
+           WHERE institution = ? COLLATE NOCASE AND tree_id LIKE ? || '%'""",
+        (prefix, institution_name, prefix)
+    ).fetchone()
+    max_num = row[0] or 0
     return f"{prefix}{max_num + 1:03d}"
 
-def calculate_co2(scientific_name: str, rcd: Optional[float] = None, dbh: Optional[float] = None) -> float:
-    species_data = load_species_data()
-    try:
-        density = species_data[species_data["scientific_name"] == scientific_name]["wood_density"].values[0]
-    except:
-        density = 0.6
+def list_institutions() -> List[str]:
+    # Same NOCASE grouping as the lookups below: one entry per institution however it was
+    # typed, read straight off idx_trees_institution_ci without a temp B-tree.
+    rows = get_conn().execute(
+        """SELECT DISTINCT institution COLLATE NOCASE FROM trees
+           WHERE institution IS NOT NULL ORDER BY 1"""
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def institution_summary(institution_name: str) -> Dict[str, Any]:
+    row = get_conn().execute(
+        """SELECT COUNT(*), COALESCE(SUM(status = 'Alive'), 0), COALESCE(SUM(co2_kg), 0)
+           FROM trees WHERE institution = ? COLLATE NOCASE""",
+        (institution_name,)
+    ).fetchone()
+    return dict(zip(["total", "alive", "co2"], row))
+
+def adoptable_tree_ids(institution_name: str) -> List[str]:
+    rows = get_conn().execute(
+        """SELECT tree_id FROM trees
+           WHERE institution = ? COLLATE NOCASE AND status = 'Alive' AND adopter_name IS NULL""",
+        (institution_name,)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def institution_has_tree(institution_name: str, tree_id: str) -> bool:
+    row = get_conn().execute(
+        "SELECT 1 FROM trees WHERE tree_id = ? AND institution = ? COLLATE NOCASE",
+        (tree_id, institution_name)
+    ).fetchone()
+    return row is not None
+
+def get_tree(tree_id: str, columns: List[str]) -> Optional[Dict[str, Any]]:
+    """Fetch only the requested columns of a single tree."""
+    cur = get_conn().execute(f"SELECT {', '.join(columns)} FROM trees WHERE tree_id = ?", (tree_id,))
+    row = cur.fetchone()
+    return dict(zip(columns, row)) if row else None
+
+def calculate_co2(scientific_name: str, rcd: Optional[float] = None, dbh: Optional[float] = None,
+                  densities: Optional[Dict[str, float]] = None) -> float:
+    if densities is None:
+        densities = species_density_map()
+    density = densities.get(scientific_name, DEFAULT_WOOD_DENSITY)
     
     if dbh is not None:
-        agb = 0.0509 * density * (dbh ** 2.5)
+        agb = AGB_DBH_K * density * (dbh ** 2.5)
     elif rcd is not None:
-        agb = 0.042 * (rcd ** 2.5)
+        agb = AGB_RCD_K * (rcd ** 2.5)
     else:
         return 0.0
         
-    bgb = 0.2 * agb
-    carbon = 0.47 * (agb + bgb)
-    return round(carbon * 3.67, 2)
+    bgb = BGB_RATIO * agb
+    carbon = CARBON_FRACTION * (agb + bgb)
+    return round(carbon * CO2_PER_CARBON, 2)
 
 # --- Authentication Function ---
-def authenticate(username: str, password: str) -> Optional[Tuple]:
+# One constant SQL string so the shared connection's statement cache reuses the prepared query
+_AUTH_SQL = "SELECT username, password, user_type, institution FROM users WHERE username = ?"
+
+def authenticate(username: str, password: str) -> Optional[sqlite3.Row]:
     try:
-        conn = sqlite3.connect(SQLITE_DB)
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = c.fetchone()
-        
-        if not user:
-            return None
-            
-        if hash_password(password) == user[1]:
-            return user
-        else:
-            return None
+        # Row factory on this cursor only; other queries on the shared connection keep plain tuples
+        cur = get_conn().cursor()
+        cur.row_factory = sqlite3.Row
+        row = cur.execute(_AUTH_SQL, (username,)).fetchone()
+        if row and verify_password(password, row["password"]):
+            return row
+        return None
             
     except Exception as e:
         print(f"Authentication error: {e}")
         return None
-    finally:
-        conn.close()
 
 # --- Create Test Users Function ---
+TEST_USERS = [
+    ("admin", "admin123", "admin", "All Institutions"),
+    ("institution1", "inst123", "school", "Greenwood High"),
+    ("public1", "public123", "public", ""),
+]
+
 def create_test_users():
-    test_users = [
-        ("admin", hash_password("admin123"), "admin", "All Institutions"),
-        ("institution1", hash_password("inst123"), "school", "Greenwood High"),
-        ("public1", hash_password("public123"), "public", "")
-    ]
-    
-    conn = sqlite3.connect(SQLITE_DB)
+    conn = get_conn()
     c = conn.cursor()
     
-    # First ensure the schema is correct
-    c.execute("PRAGMA table_info(users)")
-    columns = [col[1] for col in c.fetchall()]
-    if 'school' in columns and 'institution' not in columns:
-        c.execute("ALTER TABLE users RENAME COLUMN school TO institution")
-    
-    for user in test_users:
-        try:
-            c.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)", user)
-        except sqlite3.IntegrityError:
-            pass
-    
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        # First ensure the schema is correct
+        if not users_has_institution():
+            columns = [col[1] for col in c.execute("PRAGMA table_info(users)")]
+            if 'school' in columns and 'institution' not in columns:
+                c.execute("ALTER TABLE users RENAME COLUMN school TO institution")
+            users_has_institution.clear()
+        
+        # Existing accounts are kept, so only hash passwords for the missing ones
+        placeholders = ", ".join("?" for _ in TEST_USERS)
+        existing = {row[0] for row in c.execute(f"SELECT username FROM users WHERE username IN ({placeholders})",
+                                                 [user[0] for user in TEST_USERS])}
+        test_users = [
+            (username, ADMIN_PWD_HASH if username == "admin" else hash_password(password), user_type, institution)
+            for username, password, user_type, institution in TEST_USERS if username not in existing
+        ]
+        c.executemany("INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?)", test_users)
     st.success("Created test users with updated schema")
 
 # --- Visual Tree Growth Display ---
@@ -397,9 +758,11 @@ def login():
             if st.button("Reset Database"):
                 try:
                     # Delete the existing database file
+                    close_conn()
                     if SQLITE_DB.exists():
                         SQLITE_DB.unlink()
-                    initialize_data_files()
+                    initialize_data_files(force=True)
+                    invalidate_data_cache()
                     st.success("Database completely reset! Default admin: admin/admin123")
                 except Exception as e:
                     st.error(f"Error resetting database: {e}")
@@ -411,23 +774,19 @@ def login():
         
         if st.button("Show All Users"):
             try:
-                conn = sqlite3.connect(SQLITE_DB)
+                conn = get_conn()
                 # Handle both old and new schema
-                c = conn.cursor()
-                c.execute("PRAGMA table_info(users)")
-                columns = [col[1] for col in c.fetchall()]
-                if 'institution' in columns:
+                if users_has_institution():
                     users = pd.read_sql("SELECT username, user_type, institution FROM users", conn)
                 else:
                     users = pd.read_sql("SELECT username, user_type, school as institution FROM users", conn)
-                conn.close()
                 st.dataframe(users)
             except Exception as e:
                 st.error(f"Error showing users: {e}")
 
         if st.button("Show Database Schema"):
             try:
-                conn = sqlite3.connect(SQLITE_DB)
+                conn = get_conn()
                 c = conn.cursor()
                 
                 # Get list of tables
@@ -455,8 +814,6 @@ def login():
                         })
                     
                     st.table(pd.DataFrame(col_data))
-                
-                conn.close()
             except Exception as e:
                 st.error(f"Error showing database schema: {e}")
 
@@ -472,15 +829,14 @@ def login():
             user = authenticate(username, password)
             
             if user:
-                # Handle both old and new schema
                 user_data = {
-                    "username": user[0],
-                    "user_type": user[2],
-                    "institution": user[3] if len(user) > 3 else ""
+                    "username": user["username"],
+                    "user_type": user["user_type"],
+                    "institution": user["institution"] or ""
                 }
                 
                 st.session_state.user = user_data
-                st.success(f"Welcome {user[0]}!")
+                st.success(f"Welcome {user['username']}!")
                 time.sleep(0.5)
                 st.rerun()
             else:
@@ -488,6 +844,181 @@ def login():
                 if username == "admin":
                     st.info("Default admin password is 'admin123'")
 
+# --- Analytics Figures ---
+@st.cache_data(ttl=30, show_spinner=False)
+def _admin_figures(version: DataVersion) -> Dict[str, go.Figure]:
+    metrics = _load_admin_metrics(version)
+    return {
+        "co2_by_institution": px.bar(metrics["co2_by_institution"], x="institution", y="co2_kg", 
+                                     title="CO₂ Sequestration by Institution",
+                                     color="co2_kg",
+                                     color_continuous_scale="Greens"),
+        "status": px.pie(metrics["status_counts"], values="count", names="status", 
+                         title="Tree Status Distribution",
+                         color_discrete_sequence=px.colors.qualitative.Pastel),
+        "species": px.bar(metrics["species_counts"], x="scientific_name", y="count",
+                          title="Top 10 Tree Species",
+                          labels={"scientific_name": "Scientific Name", "count": "Number of Trees"})
+    }
+
+PAGE_SIZE = 100
+
+def show_table_page(query: str, total: int, key: str, page_size: int = PAGE_SIZE):
+    """Show one LIMIT/OFFSET page of an ordered query, with a page picker when needed."""
+    pages = max(1, math.ceil(total / page_size))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key=key)
+    st.dataframe(pd.read_sql(f"{query} LIMIT ? OFFSET ?", get_conn(),
+                             params=(page_size, (page - 1) * page_size)))
+
+# --- Admin Dashboard Tabs ---
+# Each tab is a fragment so widget interactions only rerun that tab.
+@st.fragment
+def admin_trees_tab():
+    st.subheader("All Trees")
+    show_table_page("SELECT * FROM trees ORDER BY tree_id", load_admin_metrics()["total"], key="trees_page")
+
+    st.subheader("Add/Edit Tree")
+    with st.form("admin_tree_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            tree_id = st.text_input("Tree ID*").strip()
+
+        if tree_id:
+            tree_data = load_trees_by_id([tree_id])
+
+            if not tree_data.empty:
+                tree = tree_data.iloc[0]
+                institution = tree['institution']
+                student = tree['student_name']
+                local_name = tree['local_name']
+                scientific_name = tree['scientific_name']
+
+                st.text_input("Institution Name", value=institution, disabled=True)
+                st.text_input("Student Name", value=student, disabled=True)
+                st.text_input("Local Name", value=local_name, disabled=True)
+
+                # Editable by Admin
+                scientific_name = st.text_input("Scientific Name", value=scientific_name)  
+
+                county = tree.get('county', '')
+                sub_county = tree.get('sub_county', '')
+                ward = tree.get('ward', '')
+
+                st.text_input("County", value=county, disabled=True)
+                st.text_input("Sub-County", value=sub_county, disabled=True)
+                st.text_input("Ward", value=ward, disabled=True)
+
+            else:
+                st.error("Tree ID not found. Please make sure the ID is correct.")
+
+        if st.form_submit_button("Save Tree"):
+            if tree_id and scientific_name:
+                if update_tree_fields(tree_id, scientific_name=scientific_name):
+                    st.success(f"Tree {tree_id} details updated successfully!")
+                    st.rerun()
+
+@st.fragment
+def admin_species_tab():
+    st.subheader("Tree Species Database")
+    species_data = load_species_data()
+    st.dataframe(species_data)
+
+    st.subheader("Add/Edit Species Information")
+    with st.form("species_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            local_name = st.text_input("Local Name*").strip()
+        with col2:
+            scientific_name = st.text_input("Scientific Name*").strip()
+
+        wood_density = st.number_input("Wood Density (g/cm³)", min_value=0.1, max_value=1.5, value=0.6, step=0.01)
+        benefits = st.text_area("Benefits/Ecological Importance*")
+
+        if st.form_submit_button("Save Species"):
+            if local_name and scientific_name and benefits:
+                result = upsert_species(scientific_name, local_name, wood_density, benefits)
+                if result == "updated":
+                    st.success(f"Species {scientific_name} updated successfully!")
+                elif result == "added":
+                    st.success(f"New species {scientific_name} added successfully!")
+
+                st.rerun()
+            else:
+                st.error("Please fill all required fields (marked with *)")
+
+@st.fragment
+def admin_users_tab():
+    st.subheader("User Management")
+
+    try:
+        # Use appropriate query based on schema version
+        institution_col = "institution" if users_has_institution() else "school AS institution"
+        user_count = get_conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        show_table_page(f"SELECT username, user_type, {institution_col} FROM users ORDER BY username",
+                        user_count, key="users_page")
+
+        st.subheader("Add New User")
+        with st.form("add_user_form"):
+            username = st.text_input("Username*").strip()
+            password = st.text_input("Password*", type="password").strip()
+            user_type = st.selectbox("User Type", list(USER_TYPES.keys()))
+            institution = st.text_input("Institution (for institution users)").strip()
+
+            if st.form_submit_button("Add User"):
+                if username and password:
+                    try:
+                        with transaction() as c:
+                            c.execute("INSERT INTO users VALUES (?, ?, ?, ?)",
+                                      (username, hash_password(password), user_type, institution))
+                    except sqlite3.IntegrityError:
+                        st.error("Username already exists")
+                    else:
+                        st.success("User added successfully!")
+                        # Users only appear in this tab, so skip the full-page rerun
+                        st.rerun(scope="fragment")
+
+        st.subheader("Remove User")
+        # A selectbox ships all of its options, so this one still reads every username
+        usernames = [row[0] for row in get_conn().execute("SELECT username FROM users ORDER BY username")]
+        username_to_remove = st.selectbox("Select a user to remove", usernames)
+
+        if st.button("Remove Selected User"):
+            try:
+                with transaction() as c:
+                    c.execute("DELETE FROM users WHERE username = ?", (username_to_remove,))
+            except Exception as e:
+                st.error(f"Error removing user: {e}")
+            else:
+                st.success(f"User {username_to_remove} removed successfully!")
+                st.rerun(scope="fragment")
+
+    except Exception as e:
+        st.error(f"Database error: {str(e)}")
+
+@st.fragment
+def admin_analytics_tab():
+    st.subheader("Analytics Dashboard")
+    metrics = load_admin_metrics()
+
+    # Metrics in cards, two per row (left, right)
+    render_cards([("🏫 Institutions Supported", metrics["institutions"]),
+                  ("🤝 Adopted Trees", metrics["adopted"]),
+                  ("🌳 Total Trees", metrics["total"]),
+                  ("🌍 CO₂ Sequestered", f'{round(metrics["co2"], 2)} kg')])
+
+    figures = _admin_figures(data_version())
+
+    st.subheader("CO₂ Sequestration by Institution")
+    st.plotly_chart(figures["co2_by_institution"], width="stretch")
+
+    st.subheader("Tree Status Distribution")
+    st.plotly_chart(figures["status"], width="stretch")
+
+    st.subheader("Top Tree Species")
+    st.plotly_chart(figures["species"], width="stretch")
+
 # --- Admin Dashboard with Tree Adoption and User Management ---
 def admin_dashboard():
     st.markdown("<h1 class='header-text'>🌳 Administrator Dashboard</h1>", unsafe_allow_html=True)
@@ -503,231 +1034,88 @@ def admin_dashboard():
     
     # --- Manage Trees ---
     with tab1:
-        st.subheader("All Trees")
-        trees = load_tree_data()
-        st.dataframe(trees)
-        
-        st.subheader("Add/Edit Tree")
-        with st.form("admin_tree_form"):
-            col1, col2 = st.columns(2)
-            with col1:
-                tree_id = st.text_input("Tree ID*").strip()
-            
-            if tree_id:
-                tree_data = trees[trees['tree_id'] == tree_id]
-                
-                if not tree_data.empty:
-                    tree = tree_data.iloc[0]
-                    institution = tree['institution']
-                    student = tree['student_name']
-                    local_name = tree['local_name']
-                    scientific_name = tree['scientific_name']
-                    
-                    st.text_input("Institution Name", value=institution, disabled=True)
-                    st.text_input("Student Name", value=student, disabled=True)
-                    st.text_input("Local Name", value=local_name, disabled=True)
-                    
-                    # Editable by Admin
-                    scientific_name = st.text_input("Scientific Name", value=scientific_name)  
-                    
-                    county = tree.get('county', '')
-                    sub_county = tree.get('sub_county', '')
-                    ward = tree.get('ward', '')
-                    
-                    st.text_input("County", value=county, disabled=True)
-                    st.text_input("Sub-County", value=sub_county, disabled=True)
-                    st.text_input("Ward", value=ward, disabled=True)
-
-                else:
-                    st.error("Tree ID not found. Please make sure the ID is correct.")
-            
-            if st.form_submit_button("Save Tree"):
-                if tree_id and scientific_name:
-                    trees.loc[trees['tree_id'] == tree_id, 'scientific_name'] = scientific_name
-                    if save_tree_data(trees):
-                        st.success(f"Tree {tree_id} details updated successfully!")
-                        st.rerun()
+        admin_trees_tab()
 
     # --- Manage Species ---
     with tab2:
-        st.subheader("Tree Species Database")
-        species_data = load_species_data()
-        st.dataframe(species_data)
-        
-        st.subheader("Add/Edit Species Information")
-        with st.form("species_form"):
-            col1, col2 = st.columns(2)
-            with col1:
-                local_name = st.text_input("Local Name*").strip()
-            with col2:
-                scientific_name = st.text_input("Scientific Name*").strip()
-            
-            wood_density = st.number_input("Wood Density (g/cm³)", min_value=0.1, max_value=1.5, value=0.6, step=0.01)
-            benefits = st.text_area("Benefits/Ecological Importance*")
-            
-            if st.form_submit_button("Save Species"):
-                if local_name and scientific_name and benefits:
-                    new_species = pd.DataFrame([{
-                        "scientific_name": scientific_name,
-                        "local_name": local_name,
-                        "wood_density": wood_density,
-                        "benefits": benefits
-                    }])
-                    
-                    # Check if species exists
-                    existing_species = species_data[
-                        (species_data["scientific_name"].str.lower() == scientific_name.lower()) | 
-                        (species_data["local_name"].str.lower() == local_name.lower())
-                    ]
-                    
-                    if not existing_species.empty:
-                        # Update existing species
-                        updated_species = species_data.copy()
-                        mask = (updated_species["scientific_name"].str.lower() == scientific_name.lower()) | \
-                               (updated_species["local_name"].str.lower() == local_name.lower())
-                        updated_species.loc[mask, ["local_name", "wood_density", "benefits"]] = [
-                            local_name, wood_density, benefits
-                        ]
-                        if save_species_data(updated_species):
-                            st.success(f"Species {scientific_name} updated successfully!")
-                    else:
-                        # Add new species
-                        updated_species = pd.concat([species_data, new_species], ignore_index=True)
-                        if save_species_data(updated_species):
-                            st.success(f"New species {scientific_name} added successfully!")
-                    
-                    st.rerun()
-                else:
-                    st.error("Please fill all required fields (marked with *)")
+        admin_species_tab()
 
     # --- Manage Users ---
     with tab3:
-        st.subheader("User Management")
-        
-        conn = sqlite3.connect(SQLITE_DB)
-        try:
-            # Check schema version
-            c = conn.cursor()
-            c.execute("PRAGMA table_info(users)")
-            columns = [col[1] for col in c.fetchall()]
-            
-            # Use appropriate query based on schema
-            if 'institution' in columns:
-                users = pd.read_sql("SELECT username, user_type, institution FROM users", conn)
-            else:
-                users = pd.read_sql("SELECT username, user_type, school as institution FROM users", conn)
-            
-            st.dataframe(users)
-            
-            st.subheader("Add New User")
-            with st.form("add_user_form"):
-                username = st.text_input("Username*").strip()
-                password = st.text_input("Password*", type="password").strip()
-                user_type = st.selectbox("User Type", list(USER_TYPES.keys()))
-                institution = st.text_input("Institution (for institution users)").strip()
-                
-                if st.form_submit_button("Add User"):
-                    if username and password:
-                        try:
-                            c.execute("INSERT INTO users VALUES (?, ?, ?, ?)", 
-                                    (username, hash_password(password), user_type, institution))
-                            conn.commit()
-                            st.success("User added successfully!")
-                            st.rerun()
-                        except sqlite3.IntegrityError:
-                            st.error("Username already exists")
-            
-            st.subheader("Remove User")
-            username_to_remove = st.selectbox("Select a user to remove", users["username"].values)
-            
-            if st.button("Remove Selected User"):
-                try:
-                    c.execute("DELETE FROM users WHERE username = ?", (username_to_remove,))
-                    conn.commit()
-                    st.success(f"User {username_to_remove} removed successfully!")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Error removing user: {e}")
-                    
-        except Exception as e:
-            st.error(f"Database error: {str(e)}")
-        finally:
-            conn.close()
+        admin_users_tab()
 
     # --- Analytics Dashboard ---
     with tab4:
-        st.subheader("Analytics Dashboard")
-        trees = load_tree_data()
-        
-        # Get unique institutions and adopted trees
-        unique_institutions = trees["institution"].nunique()
-        adopted_trees = len(trees[trees["adopter_name"].notna()])
-        
-        # Metrics in cards
-        col1, col2 = st.columns(2)
-        with col1:
-            st.markdown(f"""
-            <div class="card">
-                <h3>🏫 Institutions Supported</h3>
-                <h2>{unique_institutions}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown(f"""
-            <div class="card">
-                <h3>🌳 Total Trees</h3>
-                <h2>{len(trees)}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown(f"""
-            <div class="card">
-                <h3>🤝 Adopted Trees</h3>
-                <h2>{adopted_trees}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown(f"""
-            <div class="card">
-                <h3>🌍 CO₂ Sequestered</h3>
-                <h2>{round(trees["co2_kg"].sum(), 2)} kg</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        st.subheader("CO₂ Sequestration by Institution")
-        co2_by_institution = trees.groupby("institution")["co2_kg"].sum().reset_index()
-        fig = px.bar(co2_by_institution, x="institution", y="co2_kg", 
-                     title="CO₂ Sequestration by Institution",
-                     color="co2_kg",
-                     color_continuous_scale="Greens")
-        st.plotly_chart(fig)
-        
-        st.subheader("Tree Status Distribution")
-        status_counts = trees["status"].value_counts().reset_index()
-        fig = px.pie(status_counts, values="count", names="status", 
-                     title="Tree Status Distribution",
-                     color_discrete_sequence=px.colors.qualitative.Pastel)
-        st.plotly_chart(fig)
-        
-        st.subheader("Top Tree Species")
-        species_counts = trees["scientific_name"].value_counts().reset_index().head(10)
-        fig = px.bar(species_counts, x="scientific_name", y="count",
-                    title="Top 10 Tree Species",
-                    labels={"scientific_name": "Scientific Name", "count": "Number of Trees"})
-        st.plotly_chart(fig)
+        admin_analytics_tab()
 
 # --- Donor "Adopt a Tree" Section ---
-def get_location():
-    geolocator = Nominatim(user_agent="tree_monitoring_app")
-    try:
-        location = geolocator.geocode("Kenya")  # Example location
-        if location:
-            return {"latitude": location.latitude, "longitude": location.longitude}
-        else:
-            raise Exception("Location could not be fetched")
-    except Exception as e:
-        raise Exception(f"Location detection failed: {str(e)}")
+EARTH_RADIUS_M = 6371000.0
+
+def haversine_np(lat0: float, lon0: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Great-circle distance in meters from one point to arrays of points (NaN where missing)."""
+    lat0, lon0 = math.radians(lat0), math.radians(lon0)
+    # Work in two scratch arrays with in-place ufuncs rather than allocating a temporary per term
+    a = np.radians(lats)
+    b = np.radians(lons)
+    np.subtract(b, lon0, out=b)
+    np.multiply(b, 0.5, out=b)
+    np.sin(b, out=b)
+    np.square(b, out=b)
+    np.multiply(b, np.cos(a), out=b)
+    np.multiply(b, math.cos(lat0), out=b)
+    np.subtract(a, lat0, out=a)
+    np.multiply(a, 0.5, out=a)
+    np.sin(a, out=a)
+    np.square(a, out=a)
+    np.add(a, b, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    np.multiply(a, 2 * EARTH_RADIUS_M, out=a)
+    return a
+
+# One entry per data version, so cap the entries and let stale arrays expire
+@st.cache_resource(ttl=60, max_entries=8)
+def _tree_coord_index(version: DataVersion) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Latitude-sorted coordinates and IDs of all trees that have a location."""
+    trees = _load_tree_columns(version, ("tree_id", "latitude", "longitude"))
+    lats = pd.to_numeric(trees["latitude"], errors="coerce").to_numpy(dtype=float)
+    lons = pd.to_numeric(trees["longitude"], errors="coerce").to_numpy(dtype=float)
+    rows = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+    rows = rows[np.argsort(lats[rows], kind="stable")]
+    return lats[rows], lons[rows], trees["tree_id"].to_numpy()[rows]
+
+def find_nearby_trees(lat: float, lon: float, radius_m: float) -> pd.DataFrame:
+    """Trees within radius_m of (lat, lon), with a distance_m column.
+
+    A binary search on the sorted latitudes narrows the candidates to the
+    radius band, a longitude check trims that band to a bounding box, and
+    exact distances are only computed inside the box. Full rows are only
+    fetched for the matches.
+    """
+    sorted_lats, sorted_lons, tree_ids = _tree_coord_index(data_version())
+    angle = radius_m / EARTH_RADIUS_M
+    dlat = math.degrees(angle)
+    lo = np.searchsorted(sorted_lats, lat - dlat, side="left")
+    hi = np.searchsorted(sorted_lats, lat + dlat, side="right")
+    lats, lons, ids = sorted_lats[lo:hi], sorted_lons[lo:hi], tree_ids[lo:hi]
+    # Widest longitude offset on the circle; skipped when the circle reaches a pole
+    sin_ratio = math.sin(min(angle, math.pi / 2)) / max(math.cos(math.radians(lat)), 1e-12)
+    if sin_ratio < 1:
+        max_dlon = math.degrees(math.asin(sin_ratio))
+        # Wrap the difference so boxes crossing the antimeridian still match
+        in_box = np.abs((lons - lon + 180.0) % 360.0 - 180.0) <= max_dlon
+        lats, lons, ids = lats[in_box], lons[in_box], ids[in_box]
+    dist = haversine_np(lat, lon, lats, lons)
+    mask = dist <= radius_m
+    distances = dict(zip(ids[mask], np.round(dist[mask], 2)))
+    trees = load_trees_by_id(list(distances))
+    return trees.assign(distance_m=trees["tree_id"].map(distances))
+
+# Where Nominatim geocodes "Kenya"; "Detect My Location" always resolved to this point
+KENYA_CENTROID = {"latitude": 1.4419683, "longitude": 38.4313975}
+
+def get_location() -> Dict[str, float]:
+    return dict(KENYA_CENTROID)
 
 def donor_dashboard():
     st.markdown("<h1 class='header-text'>🌳 Adopt a Tree</h1>", unsafe_allow_html=True)
@@ -747,12 +1135,11 @@ def donor_dashboard():
     """, unsafe_allow_html=True)
     
     st.subheader("Select an Institution to Adopt a Tree")
-    trees = load_tree_data()
-    institutions = trees["institution"].unique()
+    institutions = list_institutions()
     selected_institution = st.selectbox("Select Institution", institutions)
     
     if selected_institution:
-        institution_trees = trees[trees["institution"] == selected_institution]
+        summary = institution_summary(selected_institution)
         
         # Institution metrics in cards
         col1, col2, col3 = st.columns(3)
@@ -760,32 +1147,29 @@ def donor_dashboard():
             st.markdown(f"""
             <div class="card">
                 <h4>Total Trees</h4>
-                <h3>{len(institution_trees)}</h3>
+                <h3>{summary["total"]}</h3>
             </div>
             """, unsafe_allow_html=True)
         with col2:
             st.markdown(f"""
             <div class="card">
                 <h4>Alive Trees</h4>
-                <h3>{len(institution_trees[institution_trees["status"] == "Alive"])}</h3>
+                <h3>{summary["alive"]}</h3>
             </div>
             """, unsafe_allow_html=True)
         with col3:
             st.markdown(f"""
             <div class="card">
                 <h4>CO₂ Sequestered</h4>
-                <h3>{round(institution_trees["co2_kg"].sum(), 2)} kg</h3>
+                <h3>{round(summary["co2"], 2)} kg</h3>
             </div>
             """, unsafe_allow_html=True)
         
-        adopt_tree = st.selectbox("Select Tree to Adopt", 
-                                institution_trees[
-                                    (institution_trees["status"] == "Alive") & 
-                                    (institution_trees["adopter_name"].isna())
-                                ]['tree_id'])
+        adopt_tree = st.selectbox("Select Tree to Adopt", adoptable_tree_ids(selected_institution))
         
         if adopt_tree:
-            tree_data = institution_trees[institution_trees["tree_id"] == adopt_tree].iloc[0]
+            tree_data = get_tree(adopt_tree, ["local_name", "scientific_name", "student_name",
+                                              "date_planted", "co2_kg", "height_m"])
             
             # Display tree visualization
             display_tree_growth(tree_data["height_m"])
@@ -799,11 +1183,12 @@ def donor_dashboard():
             donor_name = st.text_input("Enter Your Name to Adopt the Tree")
             
             if st.button("Adopt Tree") and donor_name:
-                trees.loc[trees["tree_id"] == adopt_tree, "status"] = "Adopted"
-                trees.loc[trees["tree_id"] == adopt_tree, "adopter_name"] = donor_name
-                save_tree_data(trees)
-                st.success(f"Thank you, {donor_name}, for adopting Tree {adopt_tree} at {selected_institution}!")
-                st.balloons()
+                adopted = claim_tree_for_adoption(adopt_tree, donor_name)
+                if adopted:
+                    st.success(f"Thank you, {donor_name}, for adopting Tree {adopt_tree} at {selected_institution}!")
+                    st.balloons()
+                elif adopted is False:
+                    st.warning(f"Sorry, Tree {adopt_tree} was just adopted by someone else. Please choose another tree.")
             elif not donor_name:
                 st.error("Please enter your name to adopt the tree.")
 
@@ -826,51 +1211,240 @@ def donor_dashboard():
         radius = st.slider("Search radius (meters)", 1, 100, 3)
         
         if st.button(f"🔍 Find Nearby Trees ({radius}m radius)"):
-            nearby_trees = []
-            trees = load_tree_data()
-
-            for _, tree in trees.iterrows():
-                try:
-                    if pd.isna(tree["latitude"]) or pd.isna(tree["longitude"]):
-                        continue
-                    dist = geodesic((lat, lon), (tree["latitude"], tree["longitude"])).meters
-                    if dist <= radius:
-                        nearby_trees.append({**tree.to_dict(), "distance_m": round(dist, 2)})
-                except:
-                    continue
+            # Kept in session state so the results survive the reruns from picking and editing trees
+            st.session_state.nearby_search = (lat, lon, radius)
+        
+        if "nearby_search" in st.session_state:
+            search_lat, search_lon, search_radius = st.session_state.nearby_search
+            nearby_trees = find_nearby_trees(search_lat, search_lon, search_radius).sort_values("distance_m")
             
-            if nearby_trees:
+            if not nearby_trees.empty:
                 st.success(f"Found {len(nearby_trees)} nearby trees:")
-                for tree in nearby_trees:
-                    with st.expander(f"{tree['tree_id']} - {tree['distance_m']:.1f}m away"):
-                        display_tree_growth(tree["height_m"])
-                        st.write(f"**Institution:** {tree['institution']}")
-                        st.write(f"**Local Name:** {tree['local_name']}")
-                        st.write(f"**Scientific Name:** {tree['scientific_name']}")
-                        st.write(f"**Planted by:** {tree['student_name']}")
-                        st.write(f"**Planted on:** {tree['date_planted']}")
-                        st.write(f"**Status:** {tree['status']}")
-                        st.write(f"**CO₂ Sequestered:** {tree['co2_kg']} kg")
+                # One compact table for every match; details and the form only for the chosen tree
+                st.dataframe(nearby_trees[["tree_id", "local_name", "scientific_name", "distance_m", "status"]],
+                             hide_index=True)
+                records = nearby_trees.to_dict("records")
+                choice = st.selectbox("Open tree", range(len(records)),
+                                      format_func=lambda i: f"{records[i]['tree_id']} - {records[i]['distance_m']:.1f}m away")
+                tree = records[choice]
+                
+                with st.expander(f"{tree['tree_id']} - {tree['distance_m']:.1f}m away", expanded=True):
+                    display_tree_growth(tree["height_m"])
+                    st.write(f"**Institution:** {tree['institution']}")
+                    st.write(f"**Local Name:** {tree['local_name']}")
+                    st.write(f"**Scientific Name:** {tree['scientific_name']}")
+                    st.write(f"**Planted by:** {tree['student_name']}")
+                    st.write(f"**Planted on:** {tree['date_planted']}")
+                    st.write(f"**Status:** {tree['status']}")
+                    st.write(f"**CO₂ Sequestered:** {tree['co2_kg']} kg")
+                    
+                    with st.form(f"update_form_{tree['tree_id']}"):
+                        new_status = st.selectbox("Status", ["Alive", "Dead"], index=0 if tree['status'] == "Alive" else 1)
+                        new_height = st.number_input("Tree Height (m)", value=tree["height_m"], min_value=0.1)
+                        new_rcd = st.number_input("Root Collar Diameter (cm)", value=tree["rcd_cm"] if tree["tree_stage"] == "Young (RCD)" else 0.1)
+                        new_dbh = st.number_input("Diameter at Breast Height (cm)", 
+                                              value=float(tree["dbh_cm"]) if pd.notna(tree["dbh_cm"]) else 0.1)
                         
-                        with st.form(f"update_form_{tree['tree_id']}"):
-                            new_status = st.selectbox("Status", ["Alive", "Dead"], index=0 if tree['status'] == "Alive" else 1)
-                            new_height = st.number_input("Tree Height (m)", value=tree["height_m"], min_value=0.1)
-                            new_rcd = st.number_input("Root Collar Diameter (cm)", value=tree["rcd_cm"] if tree["tree_stage"] == "Young (RCD)" else 0.1)
-                            new_dbh = st.number_input("Diameter at Breast Height (cm)", 
-                                                  value=float(tree["dbh_cm"]) if pd.notna(tree["dbh_cm"]) else 0.1)
-                            
-                            if st.form_submit_button(f"Update Tree {tree['tree_id']}"):
-                                trees.loc[trees['tree_id'] == tree['tree_id'], ['status', 'height_m', 'rcd_cm', 'dbh_cm']] = [new_status, new_height, new_rcd, new_dbh]
-                                save_tree_data(trees)
-                                st.success(f"Tree {tree['tree_id']} updated successfully!")
+                        if st.form_submit_button(f"Update Tree {tree['tree_id']}"):
+                            update_tree_fields(tree['tree_id'], status=new_status, height_m=new_height,
+                                               rcd_cm=new_rcd, dbh_cm=new_dbh)
+                            st.success(f"Tree {tree['tree_id']} updated successfully!")
 
             else:
-                st.info(f"No trees found within {radius} meters. Try increasing the search radius.")
+                st.info(f"No trees found within {search_radius} meters. Try increasing the search radius.")
         else:
             st.info("Click the '📡 Detect My Location' button to detect your location first.")
     else:
         st.info("Please detect your location using the '📡 Detect My Location' button.")
 
+# --- Institution Dashboard Tabs ---
+# Like the admin tabs, each tab is a fragment so its widgets only rerun that tab.
+@st.fragment
+def institution_trees_tab(institution_name: str):
+    st.subheader("Our Trees")
+    institution_trees = load_institution_trees(institution_name)
+    st.dataframe(institution_trees)
+
+    st.subheader("Monitor Tree")
+    tree_id = st.text_input("Enter Tree ID to Monitor").strip()
+
+    if tree_id and institution_has_tree(institution_name, tree_id):
+        # Re-read the row so the form edits exact float64 values, not the cached float32 ones
+        tree = load_trees_by_id([tree_id]).iloc[0].to_dict()
+
+        # Display tree visualization
+        display_tree_growth(tree["height_m"])
+
+        with st.form(f"monitor_form_{tree_id}"):
+            st.write(f"**Local Name:** {tree['local_name']}")
+            st.write(f"**Scientific Name:** {tree['scientific_name']}")
+            st.write(f"**Planted by:** {tree['student_name']}")
+            st.write(f"**Planted on:** {tree['date_planted']}")
+
+            status = st.selectbox(
+                "Status", 
+                ["Alive", "Dead"], 
+                index=0 if tree.get('status', "Alive") == "Alive" else 1
+            )
+
+            if status == "Alive":
+                tree_stage = st.radio(
+                    "Tree Stage", 
+                    ["Young (RCD)", "Mature (DBH)"], 
+                    index=0 if tree.get('tree_stage', "Young (RCD)") == "Young (RCD)" else 1
+                )
+
+                if tree_stage == "Young (RCD)":
+                    rcd = st.number_input(
+                        "Root Collar Diameter (cm)", 
+                        min_value=0.1, 
+                        value=float(tree.get('rcd_cm', 0.1)),
+                        step=0.1
+                    )
+                    dbh = None
+                else:
+                    dbh = st.number_input(
+                        "Diameter at Breast Height (cm)", 
+                        min_value=0.1, 
+                        value=float(tree.get('dbh_cm', 0.1)) if pd.notna(tree.get('dbh_cm')) else 0.1,
+                        step=0.1
+                    )
+                    rcd = None
+
+                height = st.number_input(
+                    "Height (meters)", 
+                    min_value=0.1, 
+                    value=float(tree.get('height_m', 0.1)),
+                    step=0.1
+                )
+
+                co2 = calculate_co2(tree['scientific_name'], rcd=rcd, dbh=dbh)
+                st.metric("CO₂ Sequestered (kg)", f"{co2}")
+
+            if st.form_submit_button("Update Tree"):
+                update_data = {
+                    "tree_stage": tree_stage if status == "Alive" else tree['tree_stage'],
+                    "rcd_cm": rcd if (status == "Alive" and tree_stage == "Young (RCD)") else tree['rcd_cm'],
+                    "dbh_cm": dbh if (status == "Alive" and tree_stage == "Mature (DBH)") else tree['dbh_cm'],
+                    "height_m": height if status == "Alive" else tree['height_m'],
+                    "co2_kg": co2 if status == "Alive" else tree['co2_kg'],
+                    "status": status
+                }
+
+                if update_tree_fields(tree['tree_id'], **update_data):
+                    st.success("Tree updated successfully!")
+                    st.rerun()
+
+@st.fragment
+def institution_planting_tab(institution_name: str):
+    st.subheader("Plant New Tree")
+
+    if st.button("📡 Detect My Location"):
+        try:
+            loc = get_location()
+            st.session_state.institution_lat = loc['latitude']
+            st.session_state.institution_lon = loc['longitude']
+            st.success(f"Location detected! Lat: {loc['latitude']:.6f}, Lon: {loc['longitude']:.6f}")
+        except Exception as e:
+            st.error(f"Location detection failed: {str(e)}")
+
+    with st.form("institution_new_tree_form"):
+        student = st.text_input("Student Name*").strip()
+
+        # Let users enter local name and select from existing species or add new
+        local_name = st.text_input("Local Name*").strip()
+
+        species_names = species_lookup()
+
+        # Option to select from existing species or add new
+        species_option = st.radio("Species Option", 
+                                ["Select from existing species", "Add new species"])
+
+        if species_option == "Select from existing species":
+            selected_species = st.selectbox("Select Species", list(species_names))
+            scientific_name = species_names.get(selected_species, "")
+        else:
+            scientific_name = st.text_input("Scientific Name (if known)").strip()
+
+        date_planted = st.date_input("Planting Date", datetime.date.today())
+
+        if 'institution_lat' in st.session_state and 'institution_lon' in st.session_state:
+            lat = st.session_state.institution_lat
+            lon = st.session_state.institution_lon
+        else:
+            lat = None
+            lon = None
+
+        county = st.text_input("County*")
+        sub_county = st.text_input("Sub-County*")
+        ward = st.text_input("Ward*")
+
+        if st.form_submit_button("🌱 Plant Tree"):
+            if student and local_name and county and sub_county and ward and lat and lon:
+                tree_id = generate_tree_id(institution_name)
+                new_tree = {
+                    "tree_id": tree_id,
+                    "institution": institution_name,
+                    "local_name": local_name,
+                    "scientific_name": scientific_name if scientific_name else "Unknown",
+                    "student_name": student,
+                    "date_planted": str(date_planted),
+                    "tree_stage": "Young (RCD)",
+                    "rcd_cm": 0.1,
+                    "dbh_cm": None,
+                    "height_m": 0.5,
+                    "latitude": lat,
+                    "longitude": lon,
+                    "co2_kg": 0.0,
+                    "status": "Alive",
+                    "county": county,
+                    "sub_county": sub_county,
+                    "ward": ward
+                }
+
+                if insert_tree(new_tree):
+                    st.success(f"Tree {tree_id} planted successfully!")
+                    st.balloons()
+
+                    # If new species was added, prompt admin to update species info
+                    if species_option == "Add new species" and scientific_name:
+                        st.info("Please ask an administrator to update the species database with scientific name and benefits")
+            else:
+                st.error("Please fill all the required fields (marked with *) including location")
+
+@st.fragment
+def institution_analytics_tab(institution_name: str):
+    st.subheader("Institution Analytics")
+    stats = institution_stats(institution_name)
+
+    # Metrics in cards, two per row (left, right)
+    render_cards([("🌳 Total Trees", stats["total"]),
+                  ("🌍 CO₂ Sequestered", f'{round(stats["co2"], 2)} kg'),
+                  ("💚 Alive Trees", stats["alive"]),
+                  ("🤝 Adopted Trees", stats["adopted"])])
+
+    st.subheader("Tree Growth Over Time")
+    fig = px.line(planting_timeline(institution_name), x="Date", y="Total Trees", 
+                  title="Tree Planting Timeline",
+                  line_shape="spline",
+                  color_discrete_sequence=["#2e8b57"])
+    st.plotly_chart(fig)
+
+    # Tree height distribution
+    st.subheader("Tree Height Distribution")
+    counts, edges = stats["height_hist"]
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges),
+                           marker_color="#4CAF50"))
+    fig.update_layout(title="Distribution of Tree Heights", xaxis_title="height_m", yaxis_title="count")
+    st.plotly_chart(fig)
+
+    # Top species in institution
+    st.subheader("Top Tree Species in Our Institution")
+    fig = px.pie(stats["species_counts"], values="count", names="scientific_name",
+                title="Top 5 Tree Species",
+                color_discrete_sequence=px.colors.qualitative.Pastel)
+    st.plotly_chart(fig)
+
 # --- Institution Dashboard ---
 def institution_dashboard(institution_name: str):
     st.markdown(f"<h1 class='header-text'>🌳 {institution_name} Dashboard</h1>", unsafe_allow_html=True)
@@ -884,229 +1458,14 @@ def institution_dashboard(institution_name: str):
     
     tab1, tab2, tab3 = st.tabs(["🌿 My Trees", "🌱 Plant New Tree", "📊 Institution Analytics"])
     
-    # --- My Trees ---
     with tab1:
-        st.subheader("Our Trees")
-        trees = load_tree_data()
-        institution_trees = trees[trees["institution"].str.lower() == institution_name.lower()]
-        st.dataframe(institution_trees)
-        
-        st.subheader("Monitor Tree")
-        tree_id = st.text_input("Enter Tree ID to Monitor").strip()
-        
-        if tree_id and tree_id in institution_trees["tree_id"].values:
-            tree = institution_trees[institution_trees["tree_id"] == tree_id].iloc[0].to_dict()
-            
-            # Display tree visualization
-            display_tree_growth(tree["height_m"])
-            
-            with st.form(f"monitor_form_{tree_id}"):
-                st.write(f"**Local Name:** {tree['local_name']}")
-                st.write(f"**Scientific Name:** {tree['scientific_name']}")
-                st.write(f"**Planted by:** {tree['student_name']}")
-                st.write(f"**Planted on:** {tree['date_planted']}")
-
-                status = st.selectbox(
-                    "Status", 
-                    ["Alive", "Dead"], 
-                    index=0 if tree.get('status', "Alive") == "Alive" else 1
-                )
-
-                if status == "Alive":
-                    tree_stage = st.radio(
-                        "Tree Stage", 
-                        ["Young (RCD)", "Mature (DBH)"], 
-                        index=0 if tree.get('tree_stage', "Young (RCD)") == "Young (RCD)" else 1
-                    )
-
-                    if tree_stage == "Young (RCD)":
-                        rcd = st.number_input(
-                            "Root Collar Diameter (cm)", 
-                            min_value=0.1, 
-                            value=float(tree.get('rcd_cm', 0.1)),
-                            step=0.1
-                        )
-                        dbh = None
-                    else:
-                        dbh = st.number_input(
-                            "Diameter at Breast Height (cm)", 
-                            min_value=0.1, 
-                            value=float(tree.get('dbh_cm', 0.1)) if pd.notna(tree.get('dbh_cm')) else 0.1,
-                            step=0.1
-                        )
-                        rcd = None
-
-                    height = st.number_input(
-                        "Height (meters)", 
-                        min_value=0.1, 
-                        value=float(tree.get('height_m', 0.1)),
-                        step=0.1
-                    )
-
-                    co2 = calculate_co2(tree['scientific_name'], rcd=rcd, dbh=dbh)
-                    st.metric("CO₂ Sequestered (kg)", f"{co2}")
-
-                if st.form_submit_button("Update Tree"):
-                    idx = trees[trees["tree_id"] == tree['tree_id']].index
-                    
-                    update_data = {
-                        "tree_stage": tree_stage if status == "Alive" else tree['tree_stage'],
-                        "rcd_cm": rcd if (status == "Alive" and tree_stage == "Young (RCD)") else tree['rcd_cm'],
-                        "dbh_cm": dbh if (status == "Alive" and tree_stage == "Mature (DBH)") else tree['dbh_cm'],
-                        "height_m": height if status == "Alive" else tree['height_m'],
-                        "co2_kg": co2 if status == "Alive" else tree['co2_kg'],
-                        "status": status
-                    }
-                    
-                    trees.loc[idx, list(update_data.keys())] = list(update_data.values())
-                    
-                    if save_tree_data(trees):
-                        st.success("Tree updated successfully!")
-                        st.rerun()
-
-    # --- Plant New Tree ---
+        institution_trees_tab(institution_name)
+    
     with tab2:
-        st.subheader("Plant New Tree")
-        
-        if st.button("📡 Detect My Location"):
-            try:
-                loc = get_location()
-                st.session_state.institution_lat = loc['latitude']
-                st.session_state.institution_lon = loc['longitude']
-                st.success(f"Location detected! Lat: {loc['latitude']:.6f}, Lon: {loc['longitude']:.6f}")
-            except Exception as e:
-                st.error(f"Location detection failed: {str(e)}")
-        
-        with st.form("institution_new_tree_form"):
-            student = st.text_input("Student Name*").strip()
-            
-            # Let users enter local name and select from existing species or add new
-            local_name = st.text_input("Local Name*").strip()
-            
-            species_data = load_species_data()
-            existing_species = species_data["local_name"].unique().tolist()
-            
-            # Option to select from existing species or add new
-            species_option = st.radio("Species Option", 
-                                    ["Select from existing species", "Add new species"])
-            
-            if species_option == "Select from existing species":
-                selected_species = st.selectbox("Select Species", existing_species)
-                scientific_name = species_data[species_data["local_name"] == selected_species]["scientific_name"].values[0]
-            else:
-                scientific_name = st.text_input("Scientific Name (if known)").strip()
-            
-            date_planted = st.date_input("Planting Date", datetime.date.today())
-            
-            if 'institution_lat' in st.session_state and 'institution_lon' in st.session_state:
-                lat = st.session_state.institution_lat
-                lon = st.session_state.institution_lon
-            else:
-                lat = None
-                lon = None
-            
-            county = st.text_input("County*")
-            sub_county = st.text_input("Sub-County*")
-            ward = st.text_input("Ward*")
-            
-            if st.form_submit_button("🌱 Plant Tree"):
-                if student and local_name and county and sub_county and ward and lat and lon:
-                    trees = load_tree_data()
-                    tree_id = generate_tree_id(institution_name)
-                    new_tree = {
-                        "tree_id": tree_id,
-                        "institution": institution_name,
-                        "local_name": local_name,
-                        "scientific_name": scientific_name if scientific_name else "Unknown",
-                        "student_name": student,
-                        "date_planted": str(date_planted),
-                        "tree_stage": "Young (RCD)",
-                        "rcd_cm": 0.1,
-                        "dbh_cm": None,
-                        "height_m": 0.5,
-                        "latitude": lat,
-                        "longitude": lon,
-                        "co2_kg": 0.0,
-                        "status": "Alive",
-                        "county": county,
-                        "sub_county": sub_county,
-                        "ward": ward
-                    }
-                    
-                    updated_trees = pd.concat([trees, pd.DataFrame([new_tree])], ignore_index=True)
-                    if save_tree_data(updated_trees):
-                        st.success(f"Tree {tree_id} planted successfully!")
-                        st.balloons()
-                        
-                        # If new species was added, prompt admin to update species info
-                        if species_option == "Add new species" and scientific_name:
-                            st.info("Please ask an administrator to update the species database with scientific name and benefits")
-                else:
-                    st.error("Please fill all the required fields (marked with *) including location")
-
-    # --- Institution Analytics ---
+        institution_planting_tab(institution_name)
+    
     with tab3:
-        st.subheader("Institution Analytics")
-        trees = load_tree_data()
-        institution_trees = trees[trees["institution"].str.lower() == institution_name.lower()]
-        
-        # Metrics in cards
-        col1, col2 = st.columns(2)
-        with col1:
-            st.markdown(f"""
-            <div class="card">
-                <h3>🌳 Total Trees</h3>
-                <h2>{len(institution_trees)}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown(f"""
-            <div class="card">
-                <h3>💚 Alive Trees</h3>
-                <h2>{len(institution_trees[institution_trees["status"] == "Alive"])}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown(f"""
-            <div class="card">
-                <h3>🌍 CO₂ Sequestered</h3>
-                <h2>{round(institution_trees["co2_kg"].sum(), 2)} kg</h2>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown(f"""
-            <div class="card">
-                <h3>🤝 Adopted Trees</h3>
-                <h2>{len(institution_trees[institution_trees["adopter_name"].notna()])}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        st.subheader("Tree Growth Over Time")
-        institution_trees["date_planted"] = pd.to_datetime(institution_trees["date_planted"])
-        timeline = institution_trees.groupby("date_planted").size().cumsum().reset_index()
-        timeline.columns = ["Date", "Total Trees"]
-        fig = px.line(timeline, x="Date", y="Total Trees", 
-                      title="Tree Planting Timeline",
-                      line_shape="spline",
-                      color_discrete_sequence=["#2e8b57"])
-        st.plotly_chart(fig)
-        
-        # Tree height distribution
-        st.subheader("Tree Height Distribution")
-        fig = px.histogram(institution_trees, x="height_m", 
-                          title="Distribution of Tree Heights",
-                          color_discrete_sequence=["#4CAF50"],
-                          nbins=20)
-        st.plotly_chart(fig)
-        
-        # Top species in institution
-        st.subheader("Top Tree Species in Our Institution")
-        species_counts = institution_trees["scientific_name"].value_counts().reset_index().head(5)
-        fig = px.pie(species_counts, values="count", names="scientific_name",
-                    title="Top 5 Tree Species",
-                    color_discrete_sequence=px.colors.qualitative.Pastel)
-        st.plotly_chart(fig)
+        institution_analytics_tab(institution_name)
 
 # --- Footer ---
 def show_footer():